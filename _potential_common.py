@@ -0,0 +1,115 @@
+"""
+Shared helpers for the potential (0-1 restoration suitability) scripts: valid-pixel
+masking, block-streamed min/max normalization and the 6-color palette, so the PNG,
+tiles and points outputs normalize the source raster the same way. Also defines the
+quantized points .bin layout shared by the points writer and the LNRS stats reader.
+"""
+
+import numpy as np
+
+# Same 6-color gradient as density map (cyan → red)
+COLOR_RANGE = np.array(
+    [
+        [1, 152, 189],
+        [73, 227, 206],
+        [216, 254, 181],
+        [254, 237, 177],
+        [254, 173, 84],
+        [209, 55, 78],
+    ],
+    dtype=np.uint8,
+)
+
+# Quantized points .bin: POINTS_BIN_MAGIC, uint32 record size, then packed little-endian records
+POINTS_BIN_MAGIC = b"WWPQ"
+POINTS_BIN_HEADER = 8
+
+
+def values_to_rgba(norm, opacity):
+    """Map array of values in [0, 1] (NaN = transparent) to RGBA using COLOR_RANGE."""
+    n = len(COLOR_RANGE) - 1
+    valid = np.isfinite(norm)
+    pos = np.clip(np.where(valid, norm, 0), 0, 1).astype(np.float64) * n
+    i = np.floor(pos).astype(np.int32).clip(0, n - 1)
+    t = (pos - i)[..., None]
+    c0 = COLOR_RANGE[i].astype(np.float64)
+    c1 = COLOR_RANGE[i + 1].astype(np.float64)
+    rgba = np.zeros(norm.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = (c0 + (c1 - c0) * t).astype(np.uint8)
+    rgba[..., :3][~valid] = 0
+    rgba[..., 3] = np.where(valid, int(255 * opacity), 0)
+    return rgba
+
+
+def palette_lut(opacity, size=256):
+    """(size, 4) RGBA lookup table: entry k is the colour of value k / (size - 1)."""
+    return values_to_rgba(np.linspace(0, 1, size), opacity)
+
+
+def data_to_rgba_lut(data, valid, vmin, vmax, lut):
+    """Quantize raw valid pixels straight to 256 palette levels and gather from lut (palette_lut).
+
+    Same colours as values_to_rgba(normalize(...)) quantized to 256 levels, i.e.
+    palette_lut(opacity)[rint(norm * 255)], without the float [0, 1] copy.
+    """
+    if vmax > vmin:
+        pos = (data - vmin) / (vmax - vmin)
+        pos *= 255
+        np.clip(pos, 0, 255, out=pos)
+        pos[~valid] = 0
+        idx = np.rint(pos).astype(np.uint8)
+    else:
+        idx = np.full(data.shape, 128, dtype=np.uint8)
+    rgba = lut[idx]
+    rgba[~valid] = 0
+    return rgba
+
+
+def valid_mask(data, nodata):
+    """Finite and not nodata (nodata None or NaN = finite only); integer data needs one pass."""
+    if nodata is None or (isinstance(nodata, float) and np.isnan(nodata)):
+        return np.isfinite(data)
+    valid = data != nodata
+    if data.dtype.kind == "f":
+        valid &= np.isfinite(data)
+    return valid
+
+
+def read_valid(src, window, nodata):
+    """Read one window of band 1 and its valid mask."""
+    block = src.read(1, window=window)
+    return block, valid_mask(block, nodata)
+
+
+def value_range(src, nodata):
+    """Stream band 1 block by block -> (vmin, vmax, n_valid) over valid pixels."""
+    vmin, vmax, n_valid = np.inf, -np.inf, 0
+    for _, window in src.block_windows(1):
+        block, valid = read_valid(src, window, nodata)
+        if valid.any():
+            vmin = min(vmin, float(np.min(block[valid])))
+            vmax = max(vmax, float(np.max(block[valid])))
+            n_valid += int(np.sum(valid))
+    return vmin, vmax, n_valid
+
+
+def normalize(data, valid, vmin, vmax):
+    """Scale valid pixels to [0, 1] with the source range; invalid -> NaN."""
+    if vmax > vmin:
+        return np.where(valid, np.clip((data - vmin) / (vmax - vmin), 0, 1), np.nan)
+    return np.where(valid, 0.5, np.nan)
+
+
+def normalize_values(values, vmin, vmax):
+    """Scale already-selected valid pixel values (1-D) to [0, 1] with the source range."""
+    if vmax > vmin:
+        return np.clip((values - vmin) / (vmax - vmin), 0, 1)
+    return np.full(values.shape, 0.5, dtype=np.float32)
+
+
+def points_bin_dtype(with_class):
+    """Packed .bin record: lon/lat int32 micro-degrees, value uint16 (x 65535)[, land class uint8]."""
+    fields = [("lon", "<i4"), ("lat", "<i4"), ("val", "<u2")]
+    if with_class:
+        fields.append(("cls", "u1"))
+    return np.dtype(fields)
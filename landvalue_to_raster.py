@@ -3,19 +3,33 @@
 Dissolve land value shapefile into 3 groups (1-2, 3, 4-5) and rasterize to the same
 grid as the potential raster. Output: landvalue_classes.tif (byte: 0=1-2, 1=3, 2=4-5, 255=nodata).
 Default grid is 100m potential; use --potential-raster data/wet_woodland_potential_10m.tif
-and --output data/landvalue_classes_10m.tif for LNRS stats. Requires: ogr2ogr (GDAL), rasterio, numpy.
-Run from repo root.
+and --output data/landvalue_classes_10m.tif for LNRS stats. Requires: ogr2ogr (GDAL), rasterio, numpy,
+pyogrio, shapely. Run from repo root.
 """
 
-import json
 import subprocess
 import argparse
 from pathlib import Path
 
 import numpy as np
 import rasterio
+from pyogrio.raw import read as ogr_read
 from rasterio.features import rasterize
+from rasterio.io import MemoryFile
+from rasterio.shutil import copy as rio_copy
 from rasterio.crs import CRS
+from shapely import from_wkb
+
+# One dissolve for all groups: one output row per class (0=1-2, 1=3, 2=4-5)
+DISSOLVE_SQL = (
+    "SELECT ST_Union(geometry) AS geometry, "
+    "CASE WHEN alc_grade IN ('Grade 1','Grade 2') THEN 0 "
+    "WHEN alc_grade = 'Grade 3' THEN 1 "
+    "ELSE 2 END AS cls "
+    "FROM landvalue "
+    "WHERE alc_grade IN ('Grade 1','Grade 2','Grade 3','Grade 4','Grade 5') "
+    "GROUP BY cls"
+)
 
 
 def main():
@@ -27,6 +41,11 @@ def main():
         help="Reference raster (grid/CRS). Use 10m raster + --output data/landvalue_classes_10m.tif for LNRS stats.",
     )
     parser.add_argument("--output", default="data/landvalue_classes.tif", help="Output class raster")
+    parser.add_argument(
+        "--all-touched",
+        action="store_true",
+        help="Burn every pixel a polygon touches in class order, as before (slower; inflates boundary classes). Default: pixel centre inside, smaller groups win shared pixels.",
+    )
     args = parser.parse_args()
 
     shp = Path(args.landvalue_shp)
@@ -40,20 +59,15 @@ def main():
     if not ref_raster.exists():
         raise FileNotFoundError(f"Reference raster not found: {ref_raster}")
 
-    # Dissolve with ogr2ogr (SQLite dialect for ST_Union)
-    for name, where, out_name in [
-        ("1-2", "alc_grade IN ('Grade 1','Grade 2')", "landvalue_group_12"),
-        ("3", "alc_grade = 'Grade 3'", "landvalue_group_3"),
-        ("4-5", "alc_grade IN ('Grade 4','Grade 5')", "landvalue_group_45"),
-    ]:
-        geojson_path = data_dir / f"{out_name}.json"
-        if not geojson_path.exists():
-            subprocess.run([
-                "ogr2ogr", "-f", "GeoJSON", "-dialect", "sqlite",
-                "-sql", f"SELECT ST_Union(geometry) as geometry FROM landvalue WHERE {where}",
-                str(geojson_path), str(shp)
-            ], check=True, capture_output=True)
-        print(f"Dissolved {name} -> {geojson_path.name}")
+    # Dissolve with ogr2ogr (SQLite dialect for ST_Union): one pass over the shapefile
+    groups_path = data_dir / "landvalue_groups.fgb"
+    if not groups_path.exists():
+        subprocess.run([
+            "ogr2ogr", "-f", "FlatGeobuf", "-dialect", "sqlite",
+            "-sql", DISSOLVE_SQL,
+            str(groups_path), str(shp)
+        ], check=True, capture_output=True)
+    print(f"Dissolved 1-2, 3, 4-5 -> {groups_path.name}")
 
     # Load geometries and rasterize to reference grid
     with rasterio.open(ref_raster) as ref:
@@ -61,14 +75,14 @@ def main():
         out_shape = ref.shape
         crs = ref.crs
 
-    shapes_values = []
-    for i, out_name in enumerate(["landvalue_group_12", "landvalue_group_3", "landvalue_group_45"]):
-        geojson_path = data_dir / f"{out_name}.json"
-        with open(geojson_path) as f:
-            fc = json.load(f)
-        if fc.get("features"):
-            geom = fc["features"][0]["geometry"]
-            shapes_values.append((geom, i))  # 0, 1, 2
+    _, _, wkb, (cls,) = ogr_read(groups_path, columns=["cls"])
+    shapes_values = [(geom, int(c)) for geom, c in zip(from_wkb(wkb), cls) if geom is not None]
+    if args.all_touched:
+        # Old behaviour: burn in class order 0, 1, 2 (later classes win shared pixels)
+        shapes_values.sort(key=lambda sv: sv[1])
+    else:
+        # Largest area first so smaller groups are burned last and win shared pixels
+        shapes_values.sort(key=lambda sv: sv[0].area, reverse=True)
 
     out_array = rasterize(
         shapes_values,
@@ -76,21 +90,39 @@ def main():
         transform=transform,
         fill=255,
         dtype=np.uint8,
-        all_touched=True,
+        all_touched=args.all_touched,
     )
 
-    with rasterio.open(
-        out_path, "w",
-        driver="GTiff",
-        width=out_array.shape[1],
-        height=out_array.shape[0],
-        count=1,
-        dtype=out_array.dtype,
-        crs=crs,
-        transform=transform,
-        nodata=255,
-    ) as dst:
-        dst.write(out_array, 1)
+    # Cloud Optimized GeoTIFF: 512px zstd tiles + nearest overviews, so window reads
+    # downstream pull a few small tiles instead of scanning the file
+    with MemoryFile() as mem:
+        with mem.open(
+            driver="GTiff",
+            width=out_array.shape[1],
+            height=out_array.shape[0],
+            count=1,
+            dtype=out_array.dtype,
+            crs=crs,
+            transform=transform,
+            nodata=255,
+            tiled=True,
+            blockxsize=512,
+            blockysize=512,
+            compress="zstd",
+            BIGTIFF="IF_SAFER",
+        ) as tmp:
+            tmp.write(out_array, 1)
+        rio_copy(
+            mem.name,
+            out_path,
+            driver="COG",
+            compress="ZSTD",
+            level=9,
+            predictor="YES",
+            blocksize=512,
+            overview_resampling="NEAREST",
+            BIGTIFF="IF_SAFER",
+        )
 
     print(f"Wrote {out_path} (0=1-2, 1=3, 2=4-5, 255=nodata)")
 
@@ -2,23 +2,208 @@
 """
 Add suitability-for-restoration stats to LNRS region polygons: hectares of land
 suitable for restoration (potential >= 0.15) by agricultural land class
-(Grade 1-2, Grade 3, Grade 4-5) per region. Uses potential points .bin (16-byte:
-lon, lat, value, class). Prefers docs/potential_points_stats.bin (10m) when present,
-else docs/potential_points.bin. Requires: pip install shapely.
+(Grade 1-2, Grade 3, Grade 4-5) per region. Uses potential points .bin (quantized
+lon, lat, value, class records, or the older 16-byte float32 layout) or the per-column
+files written by raster_potential_to_points.py. Prefers docs/potential_points_stats.bin
+(10m) when present, else docs/potential_points.bin. Requires: pip install shapely.
 """
 
 import json
+import os
 import struct
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
 from pathlib import Path
 
 import numpy as np
-from shapely import prepare
-from shapely.geometry import shape, Point
+from shapely import contains_xy, from_wkb, get_parts, prepare
+from shapely.geometry import MultiPolygon, Polygon, shape
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import numba
+    from numba import njit, prange
+except ImportError:
+    numba = None
+
+from _potential_common import POINTS_BIN_HEADER, POINTS_BIN_MAGIC, points_bin_dtype
 
 # Stats use 10m points when this file exists (from raster_potential_to_points 10m + landvalue)
 POINTS_STATS_10M = Path("docs/potential_points_stats.bin")
 POINTS_FALLBACK = Path("docs/potential_points.bin")
 
+# Suffixes of the raster_potential_to_points.py --columnar files
+COLUMN_SUFFIXES = (".i32", ".u8")
+
+# --numba: regions with more interior rings than this use shapely instead
+NUMBA_MAX_HOLES = 16
+
+# Per-worker views into the shared lon/lat/class arrays (set by _init_worker)
+_shm = None
+_lons = _lats = _classes = None
+_use_numba = False
+
+if numba is not None:
+
+    @njit(parallel=True, fastmath=True, cache=True)
+    def _ring_xor(ring_x, ring_y, pts_x, pts_y, out_mask):
+        """Crossing-number test of points against one ring, XORed into out_mask."""
+        n = len(ring_x)
+        for k in prange(len(pts_x)):
+            x = pts_x[k]
+            y = pts_y[k]
+            inside = False
+            j = n - 1
+            for i in range(n):
+                if (ring_y[i] > y) != (ring_y[j] > y):
+                    if x < (ring_x[j] - ring_x[i]) * (y - ring_y[i]) / (ring_y[j] - ring_y[i]) + ring_x[i]:
+                        inside = not inside
+                j = i
+            if inside:
+                out_mask[k] = not out_mask[k]
+
+
+def _numba_contains(shp, xs, ys):
+    """Point-in-polygon via _ring_xor: XOR of every exterior and interior ring."""
+    mask = np.zeros(len(xs), dtype=np.bool_)
+    for poly in get_parts(shp):
+        for ring in [poly.exterior, *poly.interiors]:
+            coords = np.asarray(ring.coords)[:-1]
+            _ring_xor(np.ascontiguousarray(coords[:, 0]), np.ascontiguousarray(coords[:, 1]), xs, ys, mask)
+    return mask
+
+
+def _load_geojson(path):
+    if orjson is not None:
+        return orjson.loads(path.read_bytes())
+    with open(path) as f:
+        return json.load(f)
+
+
+def _write_geojson(geojson, path):
+    if orjson is not None:
+        path.write_bytes(orjson.dumps(geojson, option=orjson.OPT_SERIALIZE_NUMPY))
+        return
+    with open(path, "w") as f:
+        json.dump(geojson, f, separators=(",", ":"))
+
+
+def _polygon(rings):
+    if not rings:
+        return Polygon()
+    return Polygon(np.asarray(rings[0]), [np.asarray(r) for r in rings[1:]])
+
+
+def _geometry(geom):
+    """GeoJSON geometry -> shapely; (Multi)Polygon rings go through NumPy, much faster than shape()."""
+    if geom["type"] == "Polygon":
+        return _polygon(geom["coordinates"])
+    if geom["type"] == "MultiPolygon":
+        return MultiPolygon([_polygon(rings) for rings in geom["coordinates"]])
+    return shape(geom)
+
+
+def _columnar_paths(points_path):
+    """Per-column files (raster_potential_to_points.py --columnar) next to points_path."""
+    return (
+        points_path.with_suffix(".lon.i32"),
+        points_path.with_suffix(".lat.i32"),
+        points_path.with_suffix(".class.u8"),
+    )
+
+
+def _has_columnar(points_path):
+    return all(p.exists() for p in _columnar_paths(points_path))
+
+
+def _columnar_base(points_path):
+    """x.lon.i32 / x.class.u8 -> x.bin, so any one column file names the whole set."""
+    if points_path.suffix in COLUMN_SUFFIXES:
+        return points_path.with_suffix("").with_suffix(".bin")
+    return points_path
+
+
+def _use_columnar(points_path):
+    """Column files when points_path names one of them, else only when the .bin itself is missing."""
+    if points_path.suffix in COLUMN_SUFFIXES:
+        return _has_columnar(_columnar_base(points_path))
+    return not points_path.exists() and _has_columnar(points_path)
+
+
+def _points_exist(points_path):
+    return _use_columnar(points_path) or (points_path.suffix not in COLUMN_SUFFIXES and points_path.exists())
+
+
+def load_points(points_path):
+    """Return lons, lats (float32) and classes (uint8) of points with land class 0-2."""
+    if _use_columnar(points_path):
+        lon_path, lat_path, class_path = _columnar_paths(_columnar_base(points_path))
+        # lon/lat stored as int32 micro-degrees
+        lons = np.memmap(lon_path, dtype=np.int32, mode="r")
+        lats = np.memmap(lat_path, dtype=np.int32, mode="r")
+        classes = np.memmap(class_path, dtype=np.uint8, mode="r")
+        valid = classes <= 2
+        lons = (lons[valid] * 1e-6).astype(np.float32)
+        lats = (lats[valid] * 1e-6).astype(np.float32)
+        return lons, lats, classes[valid]
+    with open(points_path, "rb") as f:
+        header = f.read(POINTS_BIN_HEADER)
+    if header[:4] == POINTS_BIN_MAGIC:
+        # Quantized --binary records (int32 micro-degrees); memory-mapped, not read whole
+        dtype = points_bin_dtype(True)
+        if int.from_bytes(header[4:], "little") != dtype.itemsize:
+            raise ValueError(f"{points_path} has no land class; rerun raster_potential_to_points.py with --landvalue")
+        arr = np.memmap(points_path, dtype=dtype, mode="r", offset=POINTS_BIN_HEADER)
+        valid = arr["cls"] <= 2
+        lons = (arr["lon"][valid] * 1e-6).astype(np.float32)
+        lats = (arr["lat"][valid] * 1e-6).astype(np.float32)
+        return lons, lats, arr["cls"][valid]
+    # Legacy 16 bytes each = lon, lat, value, class (float32); memory-mapped, not read whole
+    n = points_path.stat().st_size // 16
+    arr = np.memmap(points_path, dtype=np.float32, mode="r", shape=(n, 4))
+    valid = (arr[:, 3] >= 0) & (arr[:, 3] <= 2)
+    return arr[valid, 0], arr[valid, 1], arr[valid, 3].astype(np.uint8)
+
+
+def _shared_views(buf, n):
+    """lons, lats (float32) and classes (uint8) laid out back to back in buf, sorted by lat."""
+    lons = np.ndarray((n,), dtype=np.float32, buffer=buf, offset=0)
+    lats = np.ndarray((n,), dtype=np.float32, buffer=buf, offset=4 * n)
+    classes = np.ndarray((n,), dtype=np.uint8, buffer=buf, offset=8 * n)
+    return lons, lats, classes
+
+
+def _init_worker(shm_name, n, use_numba, workers):
+    global _shm, _lons, _lats, _classes, _use_numba
+    _shm = shared_memory.SharedMemory(name=shm_name)
+    _lons, _lats, _classes = _shared_views(_shm.buf, n)
+    _use_numba = use_numba
+    if use_numba:
+        # Split numba threads between worker processes to avoid oversubscription
+        numba.set_num_threads(max(1, numba.config.NUMBA_NUM_THREADS // workers))
+
+
+def _count_region(job):
+    """Count points inside one region (WKB, bbox) per land class -> (region index, counts[3])."""
+    i, wkb, (minx, miny, maxx, maxy) = job
+    shp = from_wkb(wkb)
+    # Points are sorted by lat: the bbox lat range is one contiguous slice
+    lo = np.searchsorted(_lats, miny, side="left")
+    hi = np.searchsorted(_lats, maxy, side="right")
+    slice_lons = _lons[lo:hi]
+    cand = lo + np.where((slice_lons >= minx) & (slice_lons <= maxx))[0]
+    n_holes = sum(len(poly.interiors) for poly in get_parts(shp))
+    if _use_numba and n_holes <= NUMBA_MAX_HOLES:
+        inside = _numba_contains(shp, _lons[cand], _lats[cand])
+    else:
+        prepare(shp)
+        inside = contains_xy(shp, _lons[cand], _lats[cand])
+    return i, np.bincount(_classes[cand][inside], minlength=3)
+
 
 def main():
     import argparse
@@ -27,74 +212,107 @@ def main():
     p.add_argument(
         "--points",
         default=None,
-        help="Potential points .bin (16 bytes/point). Default: potential_points_stats.bin (10m) if present, else potential_points.bin",
+        help=(
+            "Potential points .bin (--binary with --landvalue); if that file is missing, the --columnar files "
+            "with the same stem are used. Pass a column file (e.g. x.lon.i32) to read the column set even when "
+            "x.bin exists. Default: potential_points_stats.bin (10m) if present, else potential_points.bin"
+        ),
     )
     p.add_argument("--output", default=None, help="Output GeoJSON (default: overwrite --regions)")
+    p.add_argument("--workers", type=int, default=None, help="Worker processes for region counting (default: all CPUs)")
+    p.add_argument(
+        "--numba",
+        action="store_true",
+        help="Use a numba crossing-number kernel instead of shapely (faster for simple polygons). Requires: pip install numba",
+    )
     args = p.parse_args()
+    if args.numba and numba is None:
+        raise ImportError("Install numba: pip install numba")
     out_path = Path(args.output) if args.output else Path(args.regions)
     regions_path = Path(args.regions)
-    points_path = Path(args.points) if args.points else (POINTS_STATS_10M if POINTS_STATS_10M.exists() else POINTS_FALLBACK)
+    points_path = Path(args.points) if args.points else (POINTS_STATS_10M if _points_exist(POINTS_STATS_10M) else POINTS_FALLBACK)
 
-    if not points_path.exists():
+    if not _points_exist(points_path):
         raise FileNotFoundError(
             f"Points file not found: {points_path}. For 10m stats run: "
             "raster_potential_to_points.py --raster data/wet_woodland_potential_10m.tif --landvalue data/landvalue_classes_10m.tif "
-            "--output docs/potential_points_stats.bin --binary (after landvalue_to_raster.py with 10m potential)."
+            "--output docs/potential_points_stats.bin --columnar (after landvalue_to_raster.py with 10m potential)."
         )
     if not regions_path.exists():
         raise FileNotFoundError(f"Regions file not found: {regions_path}")
 
-    # Load points: 16 bytes each = lon, lat, value, class (float32)
-    buf = points_path.read_bytes()
-    n = len(buf) // 16
-    arr = np.frombuffer(buf, dtype=np.float32).reshape(n, 4)
-    valid = (arr[:, 3] >= 0) & (arr[:, 3] <= 2)
-    lons = arr[valid, 0]
-    lats = arr[valid, 1]
-    classes = arr[valid, 3].astype(np.int32)
+    if not _use_columnar(points_path) and _has_columnar(points_path):
+        print(f"Note: reading {points_path}; pass --points {points_path.with_suffix('.lon.i32')} to use the column files")
+    lons, lats, classes = load_points(points_path)
     print(f"Loaded {len(lons):,} potential points (with land class) from {points_path}")
 
     # Load regions
-    with open(regions_path) as f:
-        geojson = json.load(f)
+    geojson = _load_geojson(regions_path)
     features = geojson["features"]
     print(f"Loaded {len(features)} LNRS regions")
 
-    # Build prepared geometries and init counts
+    # Build geometries; regions are shipped to workers as WKB
     shapes = []
     for i, feat in enumerate(features):
         geom = feat.get("geometry")
         if not geom:
             shapes.append(None)
             continue
-        shp = shape(geom)
-        prepare(shp)
-        shapes.append(shp)
+        shapes.append(_geometry(geom))
 
-    # Count points per region per class: counts[feature_idx][class_012]
-    counts = [[0, 0, 0] for _ in range(len(features))]
-    for i, shp in enumerate(shapes):
-        if shp is None:
-            continue
-        minx, miny, maxx, maxy = shp.bounds
-        in_bbox = (lons >= minx) & (lons <= maxx) & (lats >= miny) & (lats <= maxy)
-        cand = np.where(in_bbox)[0]
-        for j in cand:
-            if shp.contains(Point(lons[j], lats[j])):
-                counts[i][classes[j]] += 1
-        if (i + 1) % 10 == 0:
-            print(f"  Processed {i + 1}/{len(features)} regions...")
+    # Region AABBs as one (R, 4) array: drop regions outside the point cloud extent,
+    # and run the largest first so the pool stays balanced
+    n_pts = len(lons)
+    region_idx = [i for i, shp in enumerate(shapes) if shp is not None]
+    bboxes = np.array([shapes[i].bounds for i in region_idx], dtype=np.float64).reshape(-1, 4)
+    if n_pts:
+        outside = (
+            (bboxes[:, 2] < lons.min()) | (bboxes[:, 0] > lons.max())
+            | (bboxes[:, 3] < lats.min()) | (bboxes[:, 1] > lats.max())
+        )
+    else:
+        outside = np.ones(len(region_idx), dtype=bool)
+    if outside.any():
+        print(f"Skipping {int(outside.sum())} regions outside the points extent")
+    areas = (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+    jobs = [
+        (region_idx[k], shapes[region_idx[k]].wkb, tuple(bboxes[k]))
+        for k in np.argsort(-areas, kind="stable")
+        if not outside[k]
+    ]
+
+    # Count points per region per class: counts[feature_idx, class_012].
+    # Regions are independent, so they run across processes; points live in shared memory.
+    counts = np.zeros((len(features), 3), dtype=np.int64)
+    workers = args.workers or os.cpu_count() or 1
+    chunksize = max(1, len(jobs) // (4 * workers))
+    shm = shared_memory.SharedMemory(create=True, size=max(1, 9 * n_pts))
+    try:
+        sh_lons, sh_lats, sh_classes = _shared_views(shm.buf, n_pts)
+        order = np.argsort(lats, kind="stable")
+        np.take(lons, order, out=sh_lons)
+        np.take(lats, order, out=sh_lats)
+        np.take(classes, order, out=sh_classes)
+        del order
+        del sh_lons, sh_lats, sh_classes
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(shm.name, n_pts, args.numba, workers)) as pool:
+            for done, (i, region_counts) in enumerate(pool.map(_count_region, jobs, chunksize=chunksize), 1):
+                counts[i] = region_counts
+                if done % 10 == 0:
+                    print(f"  Processed {done}/{len(jobs)} regions...")
+    finally:
+        shm.close()
+        shm.unlink()
 
     # Attach properties (each point = 1 ha)
     for i, feat in enumerate(features):
         props = feat.setdefault("properties", {})
-        props["suitable_ha_grade_12"] = round(counts[i][0], 2)
-        props["suitable_ha_grade_3"] = round(counts[i][1], 2)
-        props["suitable_ha_grade_45"] = round(counts[i][2], 2)
+        props["suitable_ha_grade_12"] = int(counts[i, 0])
+        props["suitable_ha_grade_3"] = int(counts[i, 1])
+        props["suitable_ha_grade_45"] = int(counts[i, 2])
 
     out_path.parent.mkdir(parents=True, exist_ok=True)
-    with open(out_path, "w") as f:
-        json.dump(geojson, f, separators=(",", ":"))
+    _write_geojson(geojson, out_path)
     print(f"Wrote {out_path} with suitable_ha_grade_12, suitable_ha_grade_3, suitable_ha_grade_45 per feature.")
 
 
@@ -14,30 +14,7 @@ from rasterio.enums import Resampling
 from rasterio.vrt import WarpedVRT
 from rasterio.crs import CRS
 
-
-# Same 6-color gradient as density map (cyan → red)
-COLOR_RANGE = [
-    [1, 152, 189],
-    [73, 227, 206],
-    [216, 254, 181],
-    [254, 237, 177],
-    [254, 173, 84],
-    [209, 55, 78],
-]
-
-
-def value_to_rgb(v):
-    """Map value in [0, 1] to RGB using COLOR_RANGE."""
-    v = float(np.clip(v, 0, 1))
-    n = len(COLOR_RANGE) - 1
-    pos = v * n
-    i = int(np.clip(np.floor(pos), 0, n - 1))
-    j = min(i + 1, n)
-    t = pos - i
-    r = int(COLOR_RANGE[i][0] + (COLOR_RANGE[j][0] - COLOR_RANGE[i][0]) * t)
-    g = int(COLOR_RANGE[i][1] + (COLOR_RANGE[j][1] - COLOR_RANGE[i][1]) * t)
-    b = int(COLOR_RANGE[i][2] + (COLOR_RANGE[j][2] - COLOR_RANGE[i][2]) * t)
-    return r, g, b
+from _potential_common import normalize, valid_mask, value_range, values_to_rgba
 
 
 def main():
@@ -58,50 +35,33 @@ def main():
         raise FileNotFoundError(f"Raster not found: {raster_path}. Place wet_woodland_potential.tif there and re-run.")
 
     print(f"Reading: {raster_path}")
-    with rasterio.open(raster_path) as src:
-        data = src.read(1)
+    with rasterio.Env(GDAL_NUM_THREADS="ALL_CPUS"), rasterio.open(raster_path) as src:
         nodata = src.nodata
         if nodata is None:
             nodata = np.nan
+        # Normalize with the source range (as raster_potential_to_points.py) so colours match the points
+        vmin, vmax, _ = value_range(src, nodata)
 
         # Reproject to WGS84 and resample to target width
         dst_crs = CRS.from_epsg(4326)
-        height_out = int(data.shape[0] * (args.width / data.shape[1]))
+        height_out = int(src.height * (args.width / src.width))
         with WarpedVRT(
             src,
             crs=dst_crs,
             width=args.width,
             height=height_out,
             resampling=Resampling.bilinear,
+            warp_mem_limit=1024,
+            warp_extras={"NUM_THREADS": "ALL_CPUS"},
         ) as vrt:
             reproj = vrt.read(1)
             bounds_wgs84 = list(vrt.bounds)  # left, bottom, right, top
 
         # Valid mask and normalize to 0-1 (data may already be 0-1 from MaxEnt)
-        valid_r = np.isfinite(reproj)
-        if not (nodata is None or (isinstance(nodata, float) and np.isnan(nodata))):
-            valid_r &= (reproj != nodata)
-        if valid_r.any():
-            vmin_r = float(np.nanmin(reproj[valid_r]))
-            vmax_r = float(np.nanmax(reproj[valid_r]))
-            if vmax_r > vmin_r:
-                norm = np.where(valid_r, np.clip((reproj - vmin_r) / (vmax_r - vmin_r), 0, 1), np.nan)
-            else:
-                norm = np.where(valid_r, 0.5, np.nan)
-        else:
-            norm = np.full(reproj.shape, np.nan)
+        norm = normalize(reproj, valid_mask(reproj, nodata), vmin, vmax)
 
         # Build RGBA image (same palette, alpha by opacity and validity)
-        h, w = norm.shape
-        rgb = np.zeros((h, w, 4), dtype=np.uint8)
-        for i in range(h):
-            for j in range(w):
-                v = norm[i, j]
-                if np.isnan(v) or (not np.isfinite(v)):
-                    rgb[i, j] = [0, 0, 0, 0]
-                else:
-                    r, g, b = value_to_rgb(v)
-                    rgb[i, j] = [r, g, b, int(255 * args.opacity)]
+        rgb = values_to_rgba(norm, args.opacity)
 
         # PNG: flip so row 0 is top (image convention)
         try:
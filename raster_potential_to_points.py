@@ -17,6 +17,18 @@ import rasterio
 from rasterio.warp import transform as warp_transform
 from rasterio.crs import CRS
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from pyproj import Transformer
+except ImportError:
+    Transformer = None
+
+from _potential_common import POINTS_BIN_MAGIC, normalize_values, points_bin_dtype, read_valid, value_range
+
 # Visual layer uses 100m; stats use 10m (separate run with --output docs/potential_points_stats.bin)
 DEFAULT_RASTER_VISUAL = Path("data/wet_woodland_potential.tif")
 
@@ -50,10 +62,16 @@ def main():
         default=500_000,
         help="Max points when not using --min-value (step is increased to stay under this).",
     )
-    parser.add_argument(
+    fmt = parser.add_mutually_exclusive_group()
+    fmt.add_argument(
         "--binary",
         action="store_true",
-        help="Write .bin (12 or 16 bytes/point) to stay under GitHub 100MB limit.",
+        help="Write quantized .bin (10 or 11 bytes/point) to stay under GitHub 100MB limit.",
+    )
+    fmt.add_argument(
+        "--columnar",
+        action="store_true",
+        help="Write one contiguous quantized file per column (.lon.i32, .lat.i32, .val.u8, .class.u8) for lnrs_suitability_stats.py.",
     )
     parser.add_argument(
         "--landvalue",
@@ -81,30 +99,20 @@ def main():
             nodata = np.nan
         src_crs = src.crs
         src_transform = src.transform
-        data = src.read(1)
-        h, w = data.shape
-
-        valid = np.isfinite(data)
-        if not (nodata is None or (isinstance(nodata, float) and np.isnan(nodata))):
-            valid &= (data != nodata)
-
-        # Normalize to 0-1
-        if valid.any():
-            vmin = float(np.nanmin(data[valid]))
-            vmax = float(np.nanmax(data[valid]))
-            if vmax > vmin:
-                values = np.where(valid, np.clip((data - vmin) / (vmax - vmin), 0, 1), np.nan)
-            else:
-                values = np.where(valid, 0.5, np.nan)
-        else:
-            values = np.full_like(data, np.nan)
+        h, w = src.height, src.width
+        # Stream the raster block by block; the full array is never held in memory
+        windows = [window for _, window in src.block_windows(1)]
 
+        # Pass 1: global min/max for normalization to 0-1
+        vmin, vmax, n_valid = value_range(src, nodata)
+
+        lv = None
         if use_landvalue:
-            with rasterio.open(args.landvalue) as lv:
-                if lv.shape != (h, w) or lv.transform != src_transform:
-                    raise ValueError("Land value raster must match potential raster shape and transform.")
-                lv_classes = lv.read(1)
-                lv_nodata = lv.nodata if lv.nodata is not None else 255
+            lv = rasterio.open(args.landvalue)
+            if lv.shape != (h, w) or lv.transform != src_transform:
+                lv.close()
+                raise ValueError("Land value raster must match potential raster shape and transform.")
+            lv_nodata = lv.nodata if lv.nodata is not None else 255
             print(f"Land value classes from {args.landvalue} (0=1-2, 1=3, 2=4-5)")
 
         use_min_value = args.min_value is not None
@@ -114,7 +122,6 @@ def main():
             print(f"Filtering: only pixels with suitability >= {min_val}")
         else:
             step = args.step
-            n_valid = int(np.sum(valid))
             if n_valid > 0:
                 sampled = (h // step) * (w // step)
                 while sampled > args.max_points and step < min(h, w):
@@ -123,19 +130,40 @@ def main():
             if step > args.step:
                 print(f"Step increased to {step} to stay under {args.max_points:,} points")
 
-        # Mask: valid suitability and optional filters
-        mask = valid & np.isfinite(values)
-        if use_min_value:
-            mask &= (values >= min_val)
-        if use_landvalue:
-            mask &= (lv_classes >= 0) & (lv_classes <= 2) & (lv_classes != lv_nodata)
-
-        # Apply step (when step>1, keep only rows/cols on the step grid)
-        rows, cols = np.where(mask)
-        if step > 1:
-            step_ok = (rows % step == 0) & (cols % step == 0)
-            rows, cols = rows[step_ok], cols[step_ok]
-
+        # Pass 2: per block, keep pixels passing the filters on the global step grid
+        rows_list, cols_list, vals_list, lcs_list = [], [], [], []
+        try:
+            for window in windows:
+                block, valid = read_valid(src, window, nodata)
+                # Mask: valid suitability and optional land value filter
+                mask = valid
+                if use_landvalue:
+                    lv_block = lv.read(1, window=window)
+                    mask &= (lv_block >= 0) & (lv_block <= 2) & (lv_block != lv_nodata)
+
+                # Apply step (when step>1, keep only rows/cols on the global step grid)
+                row_off, col_off = int(window.row_off), int(window.col_off)
+                r0, c0 = -row_off % step, -col_off % step
+                rr, cc = np.where(mask[r0::step, c0::step])
+                rr = rr * step + r0
+                cc = cc * step + c0
+
+                # Normalize only the selected pixels, then apply the min-value filter
+                vals = normalize_values(block[rr, cc], vmin, vmax).astype(np.float32)
+                if use_min_value:
+                    keep = vals >= min_val
+                    rr, cc, vals = rr[keep], cc[keep], vals[keep]
+                rows_list.append(rr + row_off)
+                cols_list.append(cc + col_off)
+                vals_list.append(vals)
+                if use_landvalue:
+                    lcs_list.append(lv_block[rr, cc].astype(np.float32))
+        finally:
+            if lv is not None:
+                lv.close()
+
+        rows = np.concatenate(rows_list)
+        cols = np.concatenate(cols_list)
         n_pts = len(rows)
         if n_pts == 0:
             print("No points pass filters.")
@@ -145,29 +173,52 @@ def main():
         t = src_transform
         xs = t.a * (cols + 0.5) + t.b * (rows + 0.5) + t.c
         ys = t.d * (cols + 0.5) + t.e * (rows + 0.5) + t.f
-        lons, lats = warp_transform(src_crs, CRS.from_epsg(4326), xs, ys)
+        if Transformer is not None:
+            # pyproj transforms the float64 arrays directly (rasterio's transform returns lists)
+            lons, lats = Transformer.from_crs(src_crs, "EPSG:4326", always_xy=True).transform(xs, ys)
+        else:
+            lons, lats = warp_transform(src_crs, CRS.from_epsg(4326), xs, ys)
+            lons = np.asarray(lons)
+            lats = np.asarray(lats)
 
-        vals_pt = values[rows, cols].astype(np.float32)
+        vals_pt = np.concatenate(vals_list)
         if use_landvalue:
-            lcs_pt = lv_classes[rows, cols].astype(np.float32)
+            lcs_pt = np.concatenate(lcs_list)
 
         print(f"Writing {n_pts:,} points to {out_path}")
-        if args.binary:
+        if args.columnar:
+            # Structure-of-arrays: each column streams sequentially for the stats scan.
+            # lon/lat as int32 micro-degrees, value as uint8 (value * 254; 255 = nodata).
+            np.round(lons * 1e6).astype(np.int32).tofile(out_path.with_suffix(".lon.i32"))
+            np.round(lats * 1e6).astype(np.int32).tofile(out_path.with_suffix(".lat.i32"))
+            np.round(vals_pt * 254).astype(np.uint8).tofile(out_path.with_suffix(".val.u8"))
+            if use_landvalue:
+                lcs_pt.astype(np.uint8).tofile(out_path.with_suffix(".class.u8"))
+            print(f"Columnar: {out_path.with_suffix('.*')} ({10 if use_landvalue else 9} bytes/point)")
+        elif args.binary:
             out_path = out_path.with_suffix(".bin") if out_path.suffix != ".bin" else out_path
+            # Packed records: lon/lat int32 micro-degrees, value uint16 (x 65535)[, class uint8]
+            records = np.empty(n_pts, dtype=points_bin_dtype(use_landvalue))
+            records["lon"] = np.round(lons * 1e6)
+            records["lat"] = np.round(lats * 1e6)
+            records["val"] = np.round(vals_pt * 65535)
             if use_landvalue:
-                arr = np.column_stack([np.array(lons, dtype=np.float32), np.array(lats, dtype=np.float32), vals_pt, lcs_pt])
-            else:
-                arr = np.column_stack([np.array(lons, dtype=np.float32), np.array(lats, dtype=np.float32), vals_pt])
-            arr.tofile(out_path)
-            nbytes = 16 if use_landvalue else 12
-            print(f"Binary: {out_path.stat().st_size / (1024*1024):.1f} MB ({nbytes} bytes/point)")
+                records["cls"] = lcs_pt
+            with open(out_path, "wb") as f:
+                f.write(POINTS_BIN_MAGIC + records.dtype.itemsize.to_bytes(4, "little"))
+                records.tofile(f)
+            print(f"Binary: {out_path.stat().st_size / (1024*1024):.1f} MB ({records.dtype.itemsize} bytes/point)")
         else:
+            cols_out = [np.round(lons, 6), np.round(lats, 6), np.round(vals_pt.astype(np.float64), 4)]
             if use_landvalue:
-                points = [[round(lons[i], 6), round(lats[i], 6), round(float(vals_pt[i]), 4), float(lcs_pt[i])] for i in range(n_pts)]
+                cols_out.append(lcs_pt.astype(np.float64))
+            points = np.column_stack(cols_out)
+            if orjson is not None:
+                # Serializes the (N, 3|4) float64 array directly, no per-point Python floats
+                out_path.write_bytes(orjson.dumps(points, option=orjson.OPT_SERIALIZE_NUMPY))
             else:
-                points = [[round(lons[i], 6), round(lats[i], 6), round(float(vals_pt[i]), 4)] for i in range(n_pts)]
-            with open(out_path, "w") as f:
-                json.dump(points, f, separators=(",", ":"))
+                with open(out_path, "w") as f:
+                    f.write(json.dumps(points.tolist(), separators=(",", ":")))
 
     print("Done. Use potential_points.json (or .bin) with HeatmapLayer.")
 
@@ -7,15 +7,123 @@ Use wet_woodland_mosaic_hysteresis.tif when filtering (unconnected etc.) is alre
 done in the raster; this script only derives the hexbins.
 """
 
+import os
+from concurrent.futures import ProcessPoolExecutor
+
 import numpy as np
 import rasterio
-from rasterio.warp import transform_bounds
+from rasterio.crs import CRS
+from rasterio.warp import transform as rio_transform, transform_bounds
 import json
 from pathlib import Path
-import h3
+from h3.api import basic_int as h3_int
 from tqdm import tqdm
 
-def raster_to_hexagons(raster_path, output_geojson, h3_resolution=7, threshold=0.0):
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from _potential_common import read_valid
+
+# Hexagon boundaries are built and written this many cells at a time
+EMIT_CHUNK = 65_536
+
+# One hexagon feature; filled with count, H3 index (hex) and the closed ring's JSON
+FEATURE_TEMPLATE = (
+    b'{"type":"Feature","properties":{"count":%d,"h3_index":"%x"},'
+    b'"geometry":{"type":"Polygon","coordinates":[%s]}}'
+)
+
+
+def _dumps_ring(ring):
+    """Compact JSON bytes of an (n, 2) coordinate array (orjson when installed, else stdlib json)."""
+    if orjson is not None:
+        return orjson.dumps(ring, option=orjson.OPT_SERIALIZE_NUMPY)
+    return json.dumps(ring.tolist(), separators=(",", ":")).encode()
+
+
+def _closed_rings(h3_ids):
+    """GeoJSON rings for H3 cells -> (closed [lon, lat] vertices, ring offsets, ring lengths).
+
+    H3 returns (lat, lon) rings of 5-10 vertices; flatten once, swap to [lon, lat], round to
+    5 decimal places and close every ring with one gather.
+    """
+    boundaries = [h3_int.cell_to_boundary(h3_id) for h3_id in h3_ids]
+    lengths = np.fromiter(map(len, boundaries), dtype=np.intp, count=len(boundaries))
+    verts = np.round(np.array([v for b in boundaries for v in b])[:, ::-1], 5)
+    closed_lengths = lengths + 1
+    ring_offsets = np.cumsum(closed_lengths) - closed_lengths
+    local = np.arange(closed_lengths.sum()) - np.repeat(ring_offsets, closed_lengths)
+    ring_starts = np.repeat(np.cumsum(lengths) - lengths, closed_lengths)
+    closed_idx = ring_starts + local % np.repeat(lengths, closed_lengths)
+    return verts[closed_idx], ring_offsets, closed_lengths
+
+
+def _sum_counts(ids_list, counts_list):
+    """Merge (H3 ids, counts) arrays -> sorted unique uint64 ids and their summed int64 counts."""
+    if not ids_list:
+        return np.empty(0, dtype=np.uint64), np.empty(0, dtype=np.int64)
+    ids, inverse = np.unique(np.concatenate(ids_list), return_inverse=True)
+    counts = np.bincount(inverse.ravel(), weights=np.concatenate(counts_list), minlength=len(ids))
+    return ids, counts.astype(np.int64)
+
+
+def _read_masks(src, window, nodata, threshold):
+    """Valid and wet (valid and value > threshold) masks for one window of band 1."""
+    block, valid = read_valid(src, window, nodata)
+    return valid, valid & (block > threshold)
+
+
+def _aggregate_windows(job):
+    """Worker: H3-index the wet pixels of a batch of windows -> (uint64 H3 ids, counts)."""
+    raster_path, windows, starts, nodata, threshold, h3_resolution, n_total, n_sample = job
+    cells_list = []
+    with rasterio.open(raster_path) as src:
+        # CRS objects and transform built once per batch
+        crs = src.crs
+        dst_crs = CRS.from_epsg(4326)
+        t = src.transform
+        for window, start in zip(windows, starts):
+            _, wet_mask = _read_masks(src, window, nodata, threshold)
+            rows, cols = np.where(wet_mask)
+            if n_sample < n_total:
+                # Keep exactly n_sample evenly spaced wet pixels of the whole raster: global
+                # indices k * n_total // n_sample (start = wet pixels in earlier windows)
+                k0 = -(-start * n_sample // n_total)
+                k1 = -(-(start + len(rows)) * n_sample // n_total)
+                local = np.arange(k0, k1, dtype=np.int64) * n_total // n_sample - start
+                rows, cols = rows[local], cols[local]
+            if len(rows) == 0:
+                continue
+            rows = rows + int(window.row_off)
+            cols = cols + int(window.col_off)
+
+            # Pixel centers in raster CRS (Affine: x = a*c + b*r + c, y = d*c + e*r + f)
+            xs = t.a * (cols + 0.5) + t.b * (rows + 0.5) + t.c
+            ys = t.d * (cols + 0.5) + t.e * (rows + 0.5) + t.f
+
+            # Transform to WGS84 (lat/lon) for H3 in one call per block
+            lons, lats = rio_transform(crs, dst_crs, xs, ys)
+            lons = np.asarray(lons)
+            lats = np.asarray(lats)
+            # Skip invalid coordinates
+            ok = np.isfinite(lons) & np.isfinite(lats)
+            lons, lats = lons[ok], lats[ok]
+
+            # H3 cell per pixel as a 64-bit int (no hex string per pixel)
+            cells_list.append(np.fromiter(
+                (h3_int.latlng_to_cell(lat, lon, h3_resolution) for lat, lon in zip(lats.tolist(), lons.tolist())),
+                dtype=np.uint64,
+                count=len(lats),
+            ))
+    if not cells_list:
+        return _sum_counts([], [])
+    # Count per hexagon in one C pass
+    return np.unique(np.concatenate(cells_list), return_counts=True)
+
+
+def raster_to_hexagons(raster_path, output_geojson, h3_resolution=7, threshold=0.0, workers=None):
     """
     Convert raster to hexagon-aggregated data.
 
@@ -24,109 +132,99 @@ def raster_to_hexagons(raster_path, output_geojson, h3_resolution=7, threshold=0
     - output_geojson: Output GeoJSON path
     - h3_resolution: H3 hexagon resolution (7 = ~5km edge, 8 = ~1.2km edge, 9 = ~500m edge)
     - threshold: Pixels with value > threshold count as wet woodland (default 0 = any positive)
+    - workers: Worker processes for H3 aggregation (default: all CPUs)
     """
 
     print(f"Reading raster: {raster_path}")
     print(f"H3 resolution: {h3_resolution}, threshold: > {threshold}")
 
     with rasterio.open(raster_path) as src:
-        # Read band 1 (e.g. mosaic hysteresis: 0/1 or 0–1, filtering already applied)
-        data = src.read(1)
-        transform = src.transform
+        # Band 1 is streamed block by block (e.g. mosaic hysteresis: 0/1 or 0–1, filtering already applied)
         crs = src.crs
+        dst_crs = CRS.from_epsg(4326)
         nodata = src.nodata if src.nodata is not None else 255
+        windows = [window for _, window in src.block_windows(1)]
 
-        print(f"Raster size: {data.shape}")
+        print(f"Raster size: {(src.height, src.width)}")
         print(f"CRS: {crs}")
         print(f"NoData: {nodata}")
 
         # Get bounds in WGS84 (lat/lon) for H3
-        bounds_wgs84 = transform_bounds(crs, 'EPSG:4326', *src.bounds)
+        bounds_wgs84 = transform_bounds(crs, dst_crs, *src.bounds)
         print(f"Bounds (WGS84): {bounds_wgs84}")
 
-        # Wet woodland = valid and value > threshold (mosaic hysteresis: use >0 for binary)
-        valid_mask = (data != nodata) & np.isfinite(data)
-        wet_mask = valid_mask & (data > threshold)
-        wet_count = wet_mask.sum()
-        print(f"Total valid pixels: {valid_mask.sum():,}")
+        # Pass 1: count valid and wet pixels (wet per window, for the global sample offsets)
+        valid_count = 0
+        window_wet = np.zeros(len(windows), dtype=np.int64)
+        for i, window in enumerate(windows):
+            valid_mask, wet_mask = _read_masks(src, window, nodata, threshold)
+            valid_count += int(valid_mask.sum())
+            window_wet[i] = wet_mask.sum()
+        wet_count = int(window_wet.sum())
+        starts = (np.cumsum(window_wet) - window_wet).tolist()
+        print(f"Total valid pixels: {valid_count:,}")
         print(f"Total wet woodland pixels (>{threshold}): {wet_count:,}")
 
         if wet_count == 0:
             print("No wet woodland pixels found!")
             return
 
-        # Get pixel coordinates
-        rows, cols = np.where(wet_mask)
-
         # Sample if too many points (for performance)
         max_points = 1_000_000
-        if len(rows) > max_points:
-            print(f"Sampling {max_points:,} of {len(rows):,} points...")
-            indices = np.random.choice(len(rows), max_points, replace=False)
-            rows = rows[indices]
-            cols = cols[indices]
-
-        print(f"Processing {len(rows):,} wet woodland pixels...")
-
-        # Convert pixel coordinates to geographic coordinates
-        hexagon_counts = {}
-
-        for row, col in tqdm(zip(rows, cols), total=len(rows), desc="Aggregating to hexagons"):
-            # Get pixel center coordinates in raster CRS
-            x, y = transform * (col + 0.5, row + 0.5)
-
-            # Transform to WGS84 (lat/lon) for H3
-            from rasterio.warp import transform as rio_transform
-            lon, lat = rio_transform(crs, 'EPSG:4326', [x], [y])
-
-            # Get H3 hexagon index
-            try:
-                h3_index = h3.latlng_to_cell(lat[0], lon[0], h3_resolution)
-                hexagon_counts[h3_index] = hexagon_counts.get(h3_index, 0) + 1
-            except Exception as e:
-                # Skip invalid coordinates
-                continue
+        n_sample = min(wet_count, max_points)
+        if wet_count > max_points:
+            print(f"Sampling {max_points:,} evenly spaced of {wet_count:,} points...")
+
+        # Pass 2: H3 is pure Python per pixel and holds the GIL, so batches of blocks go to
+        # worker processes, each returning per-hexagon counts that are summed here
+        workers = workers or os.cpu_count() or 1
+        batch = max(1, len(windows) // (4 * workers))
+        jobs = [
+            (str(raster_path), windows[i:i + batch], starts[i:i + batch], nodata, threshold, h3_resolution, wet_count, n_sample)
+            for i in range(0, len(windows), batch)
+        ]
+        ids_list, counts_list = [], []
+
+        def collect(results):
+            for ids, counts in tqdm(results, total=len(jobs), desc="Aggregating to hexagons"):
+                ids_list.append(ids)
+                counts_list.append(counts)
+
+        if workers == 1:
+            collect(map(_aggregate_windows, jobs))
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as pool:
+                collect(pool.map(_aggregate_windows, jobs))
+        hex_ids, hex_counts = _sum_counts(ids_list, counts_list)
+
+        print(f"Total hexagons: {len(hex_ids):,}")
+        if len(hex_ids) == 0:
+            print("No wet woodland pixels with valid WGS84 coordinates!")
+            return
 
-        print(f"Total hexagons: {len(hexagon_counts):,}")
-
-        # Convert to GeoJSON
-        features = []
-        for h3_index, count in tqdm(hexagon_counts.items(), desc="Creating GeoJSON"):
-            # Get hexagon boundary
-            boundary = h3.cell_to_boundary(h3_index)
-            # H3 returns (lat, lon), GeoJSON needs [lon, lat] - round to 5 decimal places
-            coords = [[round(lon, 5), round(lat, 5)] for lat, lon in boundary]
-            coords.append(coords[0])  # Close the polygon
-
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "count": count,
-                    "h3_index": h3_index
-                },
-                "geometry": {
-                    "type": "Polygon",
-                    "coordinates": [coords]
-                }
-            }
-            features.append(feature)
-
-        geojson = {
-            "type": "FeatureCollection",
-            "features": features
-        }
-
-        # Write output
+        # Stream features to disk chunk by chunk: only EMIT_CHUNK cells' rings exist at a time
         output_path = Path(output_geojson)
         output_path.parent.mkdir(exist_ok=True, parents=True)
 
-        with open(output_path, 'w') as f:
-            json.dump(geojson, f)
+        with open(output_path, 'wb') as f:
+            f.write(b'{"type":"FeatureCollection","features":[')
+            for i in tqdm(range(0, len(hex_ids), EMIT_CHUNK), desc="Creating GeoJSON"):
+                chunk_ids = hex_ids[i:i + EMIT_CHUNK].tolist()
+                closed, ring_offsets, closed_lengths = _closed_rings(chunk_ids)
+                # Ids become hex strings only here (fixed-width, so the sort order is unchanged);
+                # features are filled into FEATURE_TEMPLATE, no per-feature dicts
+                chunk_counts = hex_counts[i:i + EMIT_CHUNK].tolist()
+                rings = zip(chunk_ids, chunk_counts, ring_offsets.tolist(), closed_lengths.tolist())
+                for k, (h3_id, count, offset, n) in enumerate(rings):
+                    if i or k:
+                        f.write(b",")
+                    f.write(FEATURE_TEMPLATE % (count, h3_id, _dumps_ring(closed[offset:offset + n])))
+            f.write(b"]}")
 
         print(f"\n✅ Created {output_path}")
-        print(f"   Hexagons: {len(features):,}")
-        print(f"   Total wet woodland pixels: {sum(hexagon_counts.values()):,}")
-        print(f"   Max count per hexagon: {max(hexagon_counts.values()):,}")
+        print(f"   Hexagons: {len(hex_ids):,}")
+        print(f"   Total wet woodland pixels: {int(hex_counts.sum()):,}")
+        print(f"   Max count per hexagon: {int(hex_counts.max()):,}")
         print(f"   File size: {output_path.stat().st_size / 1024 / 1024:.2f} MB")
 
 
@@ -153,7 +251,8 @@ if __name__ == "__main__":
         default=0.0,
         help="Count pixels with value > this as wet woodland (default 0 = any positive)",
     )
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes for H3 aggregation (default: all CPUs)")
 
     args = parser.parse_args()
 
-    raster_to_hexagons(args.raster, args.output, args.resolution, threshold=args.threshold)
+    raster_to_hexagons(args.raster, args.output, args.resolution, threshold=args.threshold, workers=args.workers)
@@ -10,6 +10,13 @@ import json
 import re
 from pathlib import Path
 
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+LNRS_ROW_RE = re.compile(r"LNRS\s+(\d+)\s+([\d,]+\.?\d*)\s+([\d,]+\.?\d*)\s+([\d.]+)")
+
 
 def parse_report_lnrs_table(report_path: Path) -> dict[int, tuple[float, float, float]]:
     """Parse LNRS REGIONAL SUMMARY: map LNRS number -> (wet_ha, ref_area_ha, prop_pct)."""
@@ -17,7 +24,10 @@ def parse_report_lnrs_table(report_path: Path) -> dict[int, tuple[float, float,
     # Find the table (starts after "LNRS 46" / "LNRS 25" header line)
     out = {}
     for line in text.splitlines():
-        m = re.match(r"LNRS\s+(\d+)\s+([\d,]+\.?\d*)\s+([\d,]+\.?\d*)\s+([\d.]+)", line)
+        # Cheap prefix check first; only table rows reach the regex
+        if not line.startswith("LNRS"):
+            continue
+        m = LNRS_ROW_RE.match(line)
         if m:
             lnrs_num = int(m.group(1))
             wet_ha = float(m.group(2).replace(",", ""))
@@ -39,8 +49,11 @@ def main():
     stats = parse_report_lnrs_table(report_path)
     print(f"Parsed {len(stats)} LNRS rows from report")
 
-    with open(geojson_path) as f:
-        geojson = json.load(f)
+    if orjson is not None:
+        geojson = orjson.loads(geojson_path.read_bytes())
+    else:
+        with open(geojson_path) as f:
+            geojson = json.load(f)
 
     updated = 0
     for feat in geojson["features"]:
@@ -62,8 +75,11 @@ def main():
         props["region_area_ha"] = round(ref_ha, 2)
         updated += 1
 
-    with open(geojson_path, "w") as f:
-        json.dump(geojson, f, separators=(",", ":"))
+    if orjson is not None:
+        geojson_path.write_bytes(orjson.dumps(geojson))
+    else:
+        with open(geojson_path, "w") as f:
+            json.dump(geojson, f, separators=(",", ":"))
 
     print(f"Updated {updated} features in {geojson_path}")
 